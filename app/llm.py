@@ -1,7 +1,14 @@
-# file llm.py 
+# file llm.py
 
 import os
-import json
+import fcntl
+import hashlib
+import threading
+from collections import OrderedDict
+
+import diskcache
+import httpx
+import orjson
 import google.generativeai as genai
 from dotenv import load_dotenv
 
@@ -9,13 +16,30 @@ load_dotenv()
 
 MODEL = "gemini-1.5-flash"  # Model Gemini yang digunakan
 
+# Backend LLM: "gemini" (default) atau "vllm" untuk deployment
+# latency-critical dengan model lokal terkuantisasi yang diserve vLLM
+# (mis. vllm serve google/gemma-2-2b-it --quantization fp8
+#       --enable-prefix-caching --max-num-seqs 32)
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini").lower()
+VLLM_BASE_URL = os.getenv("VLLM_BASE_URL", "http://localhost:8001/v1")
+VLLM_MODEL = os.getenv("VLLM_MODEL", "google/gemma-2-2b-it")
+VLLM_MAX_TOKENS = 128
+
 # Ambil API key dari .env
 GOOGLE_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GOOGLE_API_KEY:
     raise ValueError("GEMINI_API_KEY not found in .env file")
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CHAT_HISTORY_FILE = os.path.join(BASE_DIR, "chat_history.json")
+CHAT_HISTORY_FILE = os.path.join(BASE_DIR, "chat_history.jsonl")
+LLM_CACHE_DIR = os.path.join(BASE_DIR, "llm_cache")
+
+# Cache respons LLM: layer memori (LRU) + layer disk
+CACHE_MAX_ENTRIES = 1024
+HISTORY_TAIL_TURNS = 4  # jumlah giliran terakhir yang ikut masuk kunci cache
+
+# Prompt yang sensitif waktu tidak boleh diambil dari cache
+TIME_SENSITIVE_MARKERS = ("sekarang", "hari ini", "cuaca", "jam berapa", "tanggal berapa")
 
 # Instruksi sistem untuk AI
 system_instruction = """
@@ -41,35 +65,334 @@ If you're unsure about an answer, be honest and say that you don't know.
 genai.configure(api_key=GOOGLE_API_KEY)
 model = genai.GenerativeModel(model_name=MODEL, system_instruction=system_instruction)
 
+# Jendela riwayat aktif: hanya N giliran terakhir yang dikirim ke model;
+# blok yang lebih lama diringkas di background menjadi satu giliran konteks
+ACTIVE_HISTORY_TURNS = 20       # 10 pasang user/model
+SUMMARIZE_THRESHOLD_TURNS = 40  # mulai ringkas saat riwayat melewati ini
+
+# Riwayat disimpan append-only (satu giliran per baris JSONL);
+# counter di bawah melacak giliran mana yang sudah tertulis
+_last_saved_turns = 0
+_lines_written = 0
+_last_compact_lines = 0
+
+def _turn_to_dict(turn) -> dict:
+    """Konversi satu giliran chat menjadi dict yang bisa di-serialize"""
+    if isinstance(turn, dict):
+        return turn
+    return {
+        "role": turn.role,
+        "parts": [getattr(part, "text", "") for part in turn.parts],
+    }
+
 def save_chat_history(history):
+    """Tulis hanya giliran baru sebagai baris JSONL, bukan rewrite seluruh file"""
+    global _last_saved_turns, _lines_written
     try:
-        with open(CHAT_HISTORY_FILE, "w", encoding="utf-8") as f:
-            json.dump(history, f, indent=2, ensure_ascii=False)
+        new_turns = history[_last_saved_turns:]
+        if not new_turns:
+            return
+        with open(CHAT_HISTORY_FILE, "ab") as f:
+            # advisory lock: beberapa worker uvicorn menulis ke file yang sama
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                for turn in new_turns:
+                    f.write(orjson.dumps(_turn_to_dict(turn)) + b"\n")
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        _last_saved_turns = len(history)
+        _lines_written += len(new_turns)
+        _maybe_compact(history)
+        if len(history) > SUMMARIZE_THRESHOLD_TURNS:
+            _schedule_summarization()
     except Exception as e:
         print(f"[ERROR] Gagal menyimpan riwayat chat: {e}")
 
+def _rewrite_history_file(history):
+    """Tulis ulang seluruh file riwayat dari daftar giliran"""
+    global _lines_written, _last_compact_lines
+    with open(CHAT_HISTORY_FILE, "wb") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            for turn in history:
+                f.write(orjson.dumps(_turn_to_dict(turn)) + b"\n")
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+    _lines_written = len(history)
+    _last_compact_lines = _lines_written
+
+def _maybe_compact(history):
+    """Rewrite file hanya saat jumlah baris melewati 2x ukuran compact terakhir"""
+    if _lines_written <= 2 * max(_last_compact_lines, 1):
+        return
+    try:
+        _rewrite_history_file(history)
+    except Exception as e:
+        print(f"[ERROR] Gagal memadatkan riwayat chat: {e}")
+
 def load_chat_history():
+    global _last_saved_turns, _lines_written, _last_compact_lines
+
     if not os.path.exists(CHAT_HISTORY_FILE) or os.path.getsize(CHAT_HISTORY_FILE) == 0:
         return model.start_chat(history=[])
 
     try:
-        with open(CHAT_HISTORY_FILE, "r", encoding="utf-8") as f:
-            history = json.load(f)
-            return model.start_chat(history=history)
+        history = []
+        with open(CHAT_HISTORY_FILE, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    history.append(orjson.loads(line))
+        _lines_written = len(history)
+        _last_compact_lines = len(history)
+        # hanya jendela terakhir yang direplay ke model: load O(N), bukan
+        # O(seumur hidup percakapan), dan prompt tetap bertoken terbatas
+        history = history[-ACTIVE_HISTORY_TURNS:]
+        _last_saved_turns = len(history)
+        return model.start_chat(history=history)
     except Exception as e:
         print(f"[ERROR] Gagal memuat riwayat chat: {e}")
         return model.start_chat(history=[])
 
-chat = load_chat_history()
+# Objek chat dibuat lazy per worker, bukan saat import: setiap worker
+# uvicorn yang fork tidak lagi membaca file riwayat saat startup
+_chat = None
+_chat_lock = threading.Lock()
 
-def generate_response(prompt: str) -> str:
+def _get_chat():
+    """Kembalikan singleton chat milik worker ini, muat saat pertama dipakai"""
+    global _chat
+    with _chat_lock:
+        if _chat is None:
+            _chat = load_chat_history()
+        return _chat
+
+def init_chat():
+    """Inisialisasi chat worker ini lebih awal (dipanggil warmup server)"""
+    _get_chat()
+
+# ChatSession genai tidak thread-safe dan counter riwayat di atas adalah
+# global modul: send+save harus berjalan satu per satu, seperti
+# _synthesizer_lock di tts.py
+_session_lock = threading.Lock()
+
+_summarize_lock = threading.Lock()
+_summarizing = False
+
+def _schedule_summarization():
+    """Jalankan peringkasan riwayat lama di thread background (sekali jalan)"""
+    global _summarizing
+    with _summarize_lock:
+        if _summarizing:
+            return
+        _summarizing = True
+    threading.Thread(target=_summarize_old_turns, daemon=True).start()
+
+def _summarize_old_turns():
+    """Ganti blok riwayat terlama dengan ringkasan 3 kalimat dari LLM"""
+    global _chat, _last_saved_turns, _summarizing
     try:
+        with _chat_lock:
+            history = list(_chat.history) if _chat is not None else []
+        if len(history) <= SUMMARIZE_THRESHOLD_TURNS:
+            return
+
+        old_turns = history[:-ACTIVE_HISTORY_TURNS]
+
+        lines = []
+        for turn in old_turns:
+            d = _turn_to_dict(turn)
+            lines.append(f"{d['role']}: {' '.join(d['parts'])}")
+        # panggilan peringkasan bisa lama; jalankan tanpa memegang lock
+        summary = model.generate_content(
+            "Ringkas percakapan berikut dalam 3 kalimat:\n" + "\n".join(lines)
+        ).text
+
+        # riwayat harus tetap bergantian user/model, jadi ringkasan
+        # disimpan sebagai satu pasang giliran pembuka
+        summary_turns = [
+            {"role": "user", "parts": [f"Ringkasan percakapan sebelumnya: {summary}"]},
+            {"role": "model", "parts": ["Baik, saya akan mengingat konteks tersebut."]},
+        ]
+
+        # swap + reset counter di bawah lock sesi yang sama dengan
+        # send+save: save yang sedang berjalan selesai dulu, dan save
+        # berikutnya sudah melihat sesi serta offset yang baru
+        with _session_lock:
+            with _chat_lock:
+                current = list(_chat.history) if _chat is not None else []
+            # giliran yang masuk selama peringkasan ikut dipertahankan
+            new_history = summary_turns + [
+                _turn_to_dict(turn) for turn in current[len(old_turns):]
+            ]
+            with _chat_lock:
+                _chat = model.start_chat(history=new_history)
+            _last_saved_turns = len(new_history)
+            _rewrite_history_file(new_history)
+    except Exception as e:
+        print(f"[ERROR] Gagal meringkas riwayat chat: {e}")
+    finally:
+        _summarizing = False
+
+_memory_cache = OrderedDict()
+_memory_cache_lock = threading.Lock()  # OrderedDict tidak aman lintas thread
+_disk_cache = diskcache.Cache(LLM_CACHE_DIR)  # diskcache sudah thread-safe
+
+def _history_tail(history) -> str:
+    """Ringkas N giliran terakhir menjadi string untuk kunci cache"""
+    parts = []
+    for turn in history[-HISTORY_TAIL_TURNS:]:
+        text = "".join(getattr(part, "text", "") for part in turn.parts)
+        parts.append(f"{turn.role}:{text}")
+    return "|".join(parts)
+
+def _recent_context() -> str:
+    if LLM_BACKEND == "vllm":
+        return "|".join(
+            f"{turn['role']}:{turn['content']}"
+            for turn in _vllm_history[-HISTORY_TAIL_TURNS:]
+        )
+    return _history_tail(_get_chat().history)
+
+def _cache_key(prompt: str) -> str:
+    # Sertakan backend, model dan system instruction agar cache
+    # otomatis invalid saat salah satunya berubah
+    raw = "|".join([
+        prompt.lower().strip(),
+        _recent_context(),
+        LLM_BACKEND,
+        VLLM_MODEL if LLM_BACKEND == "vllm" else MODEL,
+        system_instruction,
+    ])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _is_time_sensitive(prompt: str) -> bool:
+    lowered = prompt.lower()
+    return any(marker in lowered for marker in TIME_SENSITIVE_MARKERS)
+
+def _cache_get(key: str):
+    with _memory_cache_lock:
+        if key in _memory_cache:
+            _memory_cache.move_to_end(key)
+            return _memory_cache[key]
+    cached = _disk_cache.get(key)
+    if cached is not None:
+        _cache_put(key, cached, to_disk=False)
+    return cached
+
+def _cache_put(key: str, value: str, to_disk: bool = True):
+    with _memory_cache_lock:
+        _memory_cache[key] = value
+        _memory_cache.move_to_end(key)
+        while len(_memory_cache) > CACHE_MAX_ENTRIES:
+            _memory_cache.popitem(last=False)
+    if to_disk:
+        _disk_cache.set(key, value)
+
+# Riwayat percakapan untuk backend vLLM (format chat-completions)
+_vllm_history = []
+_vllm_client = None
+
+def _get_vllm_client() -> httpx.Client:
+    # Hanya dipanggil di bawah _session_lock, jadi check-then-create aman
+    global _vllm_client
+    if _vllm_client is None:
+        _vllm_client = httpx.Client(base_url=VLLM_BASE_URL, timeout=60.0)
+    return _vllm_client
+
+def _generate_with_vllm(prompt: str) -> str:
+    """Panggil endpoint chat-completions vLLM lokal"""
+    global _vllm_history
+    # Lock yang sama dengan jalur Gemini: riwayat dibaca dan ditambah
+    # dari beberapa worker LLM_POOL, jadi kirim+simpan harus atomik
+    with _session_lock:
+        messages = (
+            [{"role": "system", "content": system_instruction}]
+            + _vllm_history
+            + [{"role": "user", "content": prompt}]
+        )
+        response = _get_vllm_client().post("/chat/completions", json={
+            "model": VLLM_MODEL,
+            "messages": messages,
+            "max_tokens": VLLM_MAX_TOKENS,
+        })
+        response.raise_for_status()
+        text = response.json()["choices"][0]["message"]["content"]
+        _vllm_history.append({"role": "user", "content": prompt})
+        _vllm_history.append({"role": "assistant", "content": text})
+        # Jendela aktif yang sama dengan jalur Gemini agar prompt
+        # tidak tumbuh tanpa batas
+        if len(_vllm_history) > ACTIVE_HISTORY_TURNS:
+            _vllm_history = _vllm_history[-ACTIVE_HISTORY_TURNS:]
+        return text
+
+def _generate_with_gemini(prompt: str) -> str:
+    with _session_lock:
+        chat = _get_chat()
         response = chat.send_message(prompt)
         save_chat_history(chat.history)
         return response.text or "[ERROR] No response from model"
+
+def generate_response(prompt: str) -> str:
+    cacheable = not _is_time_sensitive(prompt)
+    key = _cache_key(prompt) if cacheable else None
+
+    if cacheable:
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached
+
+    try:
+        if LLM_BACKEND == "vllm":
+            try:
+                text = _generate_with_vllm(prompt)
+            except Exception as e:
+                print(f"[WARNING] vLLM backend failed, falling back to Gemini: {e}")
+                text = _generate_with_gemini(prompt)
+        else:
+            text = _generate_with_gemini(prompt)
+        if cacheable and not text.startswith("[ERROR]"):
+            _cache_put(key, text)
+        return text
     except Exception as e:
         return f"[ERROR] {str(e)}"
 
+def generate_response_stream(prompt: str):
+    """Versi streaming dari generate_response; yield potongan teks saat tiba"""
+    # backend vLLM belum mendukung streaming di sini; kirim utuh sekali
+    if LLM_BACKEND == "vllm":
+        yield generate_response(prompt)
+        return
+
+    cacheable = not _is_time_sensitive(prompt)
+    key = _cache_key(prompt) if cacheable else None
+
+    if cacheable:
+        cached = _cache_get(key)
+        if cached is not None:
+            yield cached
+            return
+
+    # lock dipegang selama stream berjalan: giliran user/model pada sesi
+    # bersama tidak boleh terselip di tengah respons yang belum selesai
+    _session_lock.acquire()
+    try:
+        chat = _get_chat()
+        response = chat.send_message(prompt, stream=True)
+        chunks = []
+        for chunk in response:
+            if chunk.text:
+                chunks.append(chunk.text)
+                yield chunk.text
+        save_chat_history(chat.history)
+        full_text = "".join(chunks)
+        if cacheable and full_text:
+            _cache_put(key, full_text)
+    except Exception as e:
+        yield f"[ERROR] {str(e)}"
+    finally:
+        _session_lock.release()
+
 # Untuk pengujian langsung
 if __name__ == "__main__":
     while True:
@@ -1,45 +1,139 @@
 # file main.py
 
 from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import FileResponse, JSONResponse
-import shutil
-import tempfile
-import uuid
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+import aiofiles
+import asyncio
+import atexit
+import io
+import orjson
 import os
+import queue
 import time
+import wave
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from logging.handlers import QueueHandler, QueueListener
 from typing import List, Dict, Any
 
-from stt import transcribe_speech_to_text
-from llm import generate_response
+from stt import stt_batcher, transcribe_speech_to_text
+from llm import generate_response, generate_response_stream, init_chat
 from tts import transcribe_text_to_speech
 
-# Setup logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("api_server.log"),
-        logging.StreamHandler()
-    ]
-)
+# Setup logging: request thread hanya memasukkan record ke queue;
+# penulisan ke file/console terjadi di thread listener terpisah
+_log_queue = queue.SimpleQueue()
+_log_formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+_log_handlers = [
+    logging.FileHandler("api_server.log"),
+    logging.StreamHandler()
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(_log_queue)])
+_log_listener = QueueListener(_log_queue, *_log_handlers, respect_handler_level=True)
+_log_listener.start()
+# flush sisa record di queue saat proses berhenti
+atexit.register(_log_listener.stop)
+
 logger = logging.getLogger("voice-chatbot")
 
 app = FastAPI(title="Voice Chatbot API")
 
-ALLOWED_AUDIO_EXTENSIONS = [".wav", ".mp3", ".ogg", ".m4a"]
-TEMP_FILES = []  # Track temporary files to clean up later
+MAX_AUDIO_BYTES = 25 * 1024 * 1024  # batas ukuran upload per request
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# (magic bytes, offset) untuk format audio yang didukung:
+# WAV, Ogg, MP3 (tag ID3 atau frame sync), dan M4A/MP4
+AUDIO_MAGIC_NUMBERS = (
+    (b"RIFF", 0),
+    (b"OggS", 0),
+    (b"ID3", 0),
+    (b"\xff\xfb", 0),
+    (b"\xff\xf3", 0),
+    (b"\xff\xf2", 0),
+    (b"ftyp", 4),
+)
+
+# Dedicated pools so blocking stages don't stall the event loop:
+# LLM calls are network-bound, TTS runs in-process (lock-serialized)
+# and would otherwise block the loop for the whole synthesis
+LLM_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="llm")
+TTS_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="tts")
+
+def _looks_like_audio(head: bytes) -> bool:
+    """Periksa magic bytes pada awal file audio"""
+    return any(head[offset:offset + len(magic)] == magic
+               for magic, offset in AUDIO_MAGIC_NUMBERS)
+
+async def _read_audio_limited(upload: UploadFile) -> bytes:
+    """
+    Baca upload secara streaming per 64 KiB dengan batas ukuran.
+
+    Menolak body yang melebihi MAX_AUDIO_BYTES (413) dan format yang
+    tidak dikenali dari magic bytes chunk pertama (400), sebelum seluruh
+    body sempat masuk memori.
+    """
+    chunks = []
+    total = 0
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if not chunks and not _looks_like_audio(chunk):
+            raise HTTPException(
+                status_code=400,
+                detail="Unsupported audio format. Allowed formats: wav, mp3, ogg, m4a"
+            )
+        total += len(chunk)
+        if total > MAX_AUDIO_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"Audio file too large. Maximum size: {MAX_AUDIO_BYTES // (1024 * 1024)} MB"
+            )
+        chunks.append(chunk)
+    if not chunks:
+        raise HTTPException(status_code=400, detail="Empty audio upload")
+    return b"".join(chunks)
+
+def _silent_wav_bytes(duration_s: float = 0.5, sample_rate: int = 16000) -> bytes:
+    """Buat WAV hening singkat di memori untuk warmup STT"""
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(b"\x00\x00" * int(duration_s * sample_rate))
+    return buf.getvalue()
+
+@app.on_event("startup")
+async def warmup_models():
+    """Pre-warm the models so the first request doesn't pay cold-start"""
+    loop = asyncio.get_running_loop()
+    start_time = time.time()
+
+    # STT: satu inferensi dummy mengisi cache kernel & alokasi model
+    try:
+        await loop.run_in_executor(None, transcribe_speech_to_text, _silent_wav_bytes())
+    except Exception as e:
+        logger.error("STT warmup failed: %s", e)
 
-@app.on_event("shutdown")
-async def cleanup_temp_files():
-    """Clean up any temporary files when the server shuts down"""
-    for file_path in TEMP_FILES:
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-                logger.info(f"Cleaned up temp file: {file_path}")
-            except Exception as e:
-                logger.error(f"Failed to clean up {file_path}: {e}")
+    # LLM: muat riwayat & inisialisasi objek chat worker ini; tidak perlu
+    # membakar satu panggilan API (yang juga mengotori riwayat)
+    try:
+        await loop.run_in_executor(LLM_POOL, init_chat)
+    except Exception as e:
+        logger.error("LLM warmup failed: %s", e)
+
+    # TTS: sintesis pendek memuat bobot dan men-autotune kernel CUDA;
+    # hasilnya tinggal di cache TTS dan langsung berguna untuk sapaan
+    try:
+        await loop.run_in_executor(TTS_POOL, transcribe_text_to_speech, "halo")
+    except Exception as e:
+        logger.error("TTS warmup failed: %s", e)
+
+    logger.info("Model warmup completed in %.1fs", time.time() - start_time)
 
 @app.get("/")
 async def root():
@@ -59,76 +153,66 @@ async def voice_chat(audio: UploadFile = File(...)):
     """
     process_times = {}
     response_data = {}
-    
-    # Validate file format
+    loop = asyncio.get_running_loop()
+
     file_ext = os.path.splitext(audio.filename)[1].lower()
-    if file_ext not in ALLOWED_AUDIO_EXTENSIONS:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Unsupported audio format. Allowed formats: {', '.join(ALLOWED_AUDIO_EXTENSIONS)}"
-        )
-    
-    # Create a temporary directory for processing
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # 1. Save uploaded audio to temp file
-        start_time = time.time()
-        temp_audio_path = os.path.join(tmpdir, f"{uuid.uuid4()}{file_ext}")
-        
-        try:
-            with open(temp_audio_path, "wb") as buffer:
-                shutil.copyfileobj(audio.file, buffer)
-            process_times["save_audio"] = f"{(time.time() - start_time):.3f}s"
-            logger.info(f"Audio saved to {temp_audio_path}")
-        except Exception as e:
-            logger.error(f"Failed to save audio: {str(e)}")
-            raise HTTPException(status_code=500, detail=f"Failed to process audio: {str(e)}")
 
-        # 2. Speech-to-Text
-        start_time = time.time()
-        try:
-            with open(temp_audio_path, "rb") as audio_file:
-                audio_bytes = audio_file.read()
-            user_text = transcribe_speech_to_text(audio_bytes, file_ext=file_ext)
-            process_times["speech_to_text"] = f"{(time.time() - start_time):.3f}s"
-            response_data["transcribed_text"] = user_text
-            logger.info(f"Transcribed text: {user_text}")
-        except Exception as e:
-            error_msg = f"Speech-to-text failed: {str(e)}"
-            logger.error(error_msg)
-            raise HTTPException(status_code=500, detail=error_msg)
+    # 1. Stream the upload into memory with a size cap and magic-byte check
+    start_time = time.time()
+    try:
+        audio_bytes = await _read_audio_limited(audio)
+        process_times["read_audio"] = f"{(time.time() - start_time):.3f}s"
+        logger.info("Audio received (%d bytes)", len(audio_bytes))
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error("Failed to read audio: %s", e)
+        raise HTTPException(status_code=500, detail=f"Failed to process audio: {str(e)}")
 
-        # 3. Generate response from LLM
-        start_time = time.time()
-        try:
-            ai_response = generate_response(user_text.strip())
-            process_times["llm_response"] = f"{(time.time() - start_time):.3f}s"
-            response_data["ai_response"] = ai_response
-            logger.info(f"AI Response: {ai_response}")
-        except Exception as e:
-            error_msg = f"LLM processing failed: {str(e)}"
-            logger.error(error_msg)
-            raise HTTPException(status_code=500, detail=error_msg)
+    # 2. Speech-to-Text
+    start_time = time.time()
+    try:
+        user_text = await stt_batcher.submit(audio_bytes, file_ext=file_ext)
+        process_times["speech_to_text"] = f"{(time.time() - start_time):.3f}s"
+        response_data["transcribed_text"] = user_text
+        logger.info("Transcribed text: %s", user_text)
+    except Exception as e:
+        error_msg = f"Speech-to-text failed: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
 
-        # 4. Text-to-Speech
-        start_time = time.time()
-        try:
-            audio_output_path = transcribe_text_to_speech(ai_response)
-            TEMP_FILES.append(audio_output_path)  # Track for cleanup
-            process_times["text_to_speech"] = f"{(time.time() - start_time):.3f}s"
-            logger.info(f"TTS output saved to {audio_output_path}")
-        except Exception as e:
-            error_msg = f"Text-to-speech failed: {str(e)}"
-            logger.error(error_msg)
-            raise HTTPException(status_code=500, detail=error_msg)
+    # 3. Generate response from LLM
+    start_time = time.time()
+    try:
+        ai_response = await loop.run_in_executor(LLM_POOL, generate_response, user_text.strip())
+        process_times["llm_response"] = f"{(time.time() - start_time):.3f}s"
+        response_data["ai_response"] = ai_response
+        logger.info("AI Response: %s", ai_response)
+    except Exception as e:
+        error_msg = f"LLM processing failed: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    # 4. Text-to-Speech
+    start_time = time.time()
+    try:
+        audio_output_path = await loop.run_in_executor(TTS_POOL, transcribe_text_to_speech, ai_response)
+        process_times["text_to_speech"] = f"{(time.time() - start_time):.3f}s"
+        logger.info("TTS output saved to %s", audio_output_path)
+    except Exception as e:
+        error_msg = f"Text-to-speech failed: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
 
     # Calculate total process time
     response_data["process_times"] = process_times
     response_data["total_process_time"] = sum(float(t.rstrip('s')) for t in process_times.values())
     
     # Return both the audio file and processing metadata as headers
-    headers = {"X-Process-Info": f"{response_data}"}
+    headers = {"X-Process-Info": orjson.dumps(response_data).decode()}
     
-    # Return the audio file with processing metadata
+    # Return the audio file with processing metadata; the file lives in
+    # the TTS cache, which evicts old entries itself
     return FileResponse(
         path=audio_output_path,
         media_type="audio/wav",
@@ -136,6 +220,142 @@ async def voice_chat(audio: UploadFile = File(...)):
         headers=headers
     )
 
+# Batas kalimat untuk memotong stream LLM menjadi potongan TTS
+SENTENCE_TERMINATORS = (".", "!", "?", "\n")
+
+# Konvensi WAV streaming: ukuran tidak diketahui di muka
+_WAV_UNKNOWN_SIZE = (0xFFFFFFFF).to_bytes(4, "little")
+
+def _split_wav(data: bytes):
+    """
+    Pisahkan header RIFF (sampai awal chunk 'data') dari frame PCM.
+
+    Chunk 'data' dicari lewat struktur RIFF, bukan offset 44 byte tetap,
+    supaya chunk tambahan (mis. LIST) tidak merusak audio.
+    """
+    if data[:4] != b"RIFF":
+        return b"", data
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        chunk_size = int.from_bytes(data[pos + 4:pos + 8], "little")
+        if chunk_id == b"data":
+            header_end = pos + 8
+            return data[:header_end], data[header_end:]
+        pos += 8 + chunk_size + (chunk_size & 1)
+    return b"", data
+
+def _streaming_wav_header(header: bytes) -> bytes:
+    """Patch ukuran RIFF dan chunk 'data' ke 0xFFFFFFFF (panjang tak diketahui)"""
+    patched = bytearray(header)
+    patched[4:8] = _WAV_UNKNOWN_SIZE
+    patched[-4:] = _WAV_UNKNOWN_SIZE
+    return bytes(patched)
+
+def _drain_sentences(buffer: str):
+    """Pisahkan kalimat-kalimat lengkap dari buffer teks streaming"""
+    sentences = []
+    start = 0
+    for i, char in enumerate(buffer):
+        if char in SENTENCE_TERMINATORS:
+            sentence = buffer[start:i + 1].strip()
+            if sentence:
+                sentences.append(sentence)
+            start = i + 1
+    return sentences, buffer[start:]
+
+@app.post("/voice-chat-stream")
+async def voice_chat_stream(audio: UploadFile = File(...)):
+    """
+    Process voice input and stream the audio response
+
+    Pipelines the stages: LLM tokens are consumed as they arrive, each
+    completed sentence is synthesized immediately, and the resulting WAV
+    frames are streamed back — so time-to-first-audio is roughly
+    STT + first sentence of LLM + one TTS call instead of the full pipeline.
+
+    Args:
+        audio (UploadFile): The uploaded audio file
+
+    Returns:
+        StreamingResponse: The audio response stream
+    """
+    loop = asyncio.get_running_loop()
+
+    file_ext = os.path.splitext(audio.filename)[1].lower()
+    audio_bytes = await _read_audio_limited(audio)
+
+    try:
+        user_text = await stt_batcher.submit(audio_bytes, file_ext=file_ext)
+        logger.info("Transcribed text: %s", user_text)
+    except Exception as e:
+        error_msg = f"Speech-to-text failed: {str(e)}"
+        logger.error(error_msg)
+        raise HTTPException(status_code=500, detail=error_msg)
+
+    audio_queue: asyncio.Queue = asyncio.Queue()
+
+    def _next_chunk(generator):
+        try:
+            return next(generator)
+        except StopIteration:
+            return None
+
+    async def _synthesize(sentence: str, first: bool) -> bool:
+        """Sintesis satu kalimat; True bila ada audio yang masuk antrean"""
+        path = await loop.run_in_executor(TTS_POOL, transcribe_text_to_speech, sentence)
+        if path.startswith("[ERROR]"):
+            logger.error("Streaming TTS failed: %s", path)
+            return False
+        async with aiofiles.open(path, "rb") as f:
+            data = await f.read()
+        # potongan pertama membawa header dengan ukuran "tak diketahui";
+        # potongan lanjutan dikirim PCM-nya saja agar stream tetap satu WAV
+        header, frames = _split_wav(data)
+        if first and header:
+            await audio_queue.put(_streaming_wav_header(header) + frames)
+        else:
+            await audio_queue.put(frames)
+        return True
+
+    async def _produce_audio():
+        generator = generate_response_stream(user_text.strip())
+        buffer = ""
+        first = True
+        try:
+            while True:
+                chunk = await loop.run_in_executor(LLM_POOL, _next_chunk, generator)
+                if chunk is None:
+                    break
+                buffer += chunk
+                sentences, buffer = _drain_sentences(buffer)
+                for sentence in sentences:
+                    # first baru dilepas setelah ada potongan ber-header
+                    # yang benar-benar terkirim; kalau TTS kalimat pertama
+                    # gagal, kalimat berikutnya yang membawa header
+                    if await _synthesize(sentence, first):
+                        first = False
+            if buffer.strip():
+                await _synthesize(buffer.strip(), first)
+        except Exception as e:
+            logger.error("Streaming pipeline failed: %s", e)
+        finally:
+            await audio_queue.put(None)
+
+    producer = asyncio.create_task(_produce_audio())
+
+    async def _stream():
+        try:
+            while True:
+                item = await audio_queue.get()
+                if item is None:
+                    break
+                yield item
+        finally:
+            producer.cancel()
+
+    return StreamingResponse(_stream(), media_type="audio/wav")
+
 @app.get("/status")
 async def get_status():
     """Get API status and components health"""
@@ -152,10 +372,10 @@ async def get_status():
 def check_stt_health() -> Dict[str, Any]:
     """Check STT component health"""
     try:
-        # Basic check if whisper binary exists
-        from stt import WHISPER_BINARY
-        exists = os.path.exists(WHISPER_BINARY)
-        return {"status": "ok" if exists else "error", "message": f"Binary exists: {exists}"}
+        # Basic check if the in-process whisper model is loaded
+        from stt import WHISPER_MODEL, WHISPER_MODEL_NAME
+        loaded = WHISPER_MODEL is not None
+        return {"status": "ok" if loaded else "error", "message": f"Model loaded: {WHISPER_MODEL_NAME}"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
@@ -177,4 +397,17 @@ def check_tts_health() -> Dict[str, Any]:
         exists = os.path.exists(COQUI_MODEL_PATH)
         return {"status": "ok" if exists else "error", "message": f"Model exists: {exists}"}
     except Exception as e:
-        return {"status": "error", "message": str(e)}
\ No newline at end of file
+        return {"status": "error", "message": str(e)}
+if __name__ == "__main__":
+    import uvicorn
+
+    # uvloop + httptools: scheduling task dan parsing HTTP lebih cepat
+    # dari selector loop + h11 bawaan, terasa pada upload audio besar
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+    )
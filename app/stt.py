@@ -1,56 +1,170 @@
 # file stt.py
 
+import asyncio
+import io
 import os
-import uuid
-import tempfile
-import subprocess
+
+import ctranslate2
+import librosa
+import numpy as np
+import soundfile as sf
+from faster_whisper import BatchedInferencePipeline, WhisperModel
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
-# path ke folder utilitas STT
-WHISPER_DIR = os.path.join(BASE_DIR, "whisper.cpp")
+# Direktori model hasil konversi CTranslate2 (lihat README):
+#   ct2-transformers-converter --model openai/whisper-small \
+#       --output_dir app/models/whisper-small-ct2 --quantization int8
+WHISPER_CT2_DIR = os.path.join(BASE_DIR, "models", "whisper-small-ct2")
+
+# Pakai model terkonversi lokal bila ada; kalau belum, unduh dari hub
+WHISPER_MODEL_NAME = WHISPER_CT2_DIR if os.path.isdir(WHISPER_CT2_DIR) else "small"
+
+# INT8 murni di CPU (GEMM oneDNN/VNNI), INT8 dengan aktivasi FP16 di GPU
+_HAS_CUDA = ctranslate2.get_cuda_device_count() > 0
+WHISPER_DEVICE = "cuda" if _HAS_CUDA else "cpu"
+WHISPER_COMPUTE_TYPE = "int8_float16" if _HAS_CUDA else "int8"
+
+# Sample rate yang diharapkan model whisper
+WHISPER_SAMPLE_RATE = 16000
+
+# Muat model sekali saat import agar bobot tetap resident di memori,
+# bukan reload per request seperti pada subprocess whisper.cpp
+WHISPER_MODEL = WhisperModel(
+    WHISPER_MODEL_NAME,
+    device=WHISPER_DEVICE,
+    compute_type=WHISPER_COMPUTE_TYPE
+)
+
+# Pipeline batched di atas model yang sama; batching terjadi di dalam
+# satu klip (antar potongan VAD), bukan antar request
+WHISPER_PIPELINE = BatchedInferencePipeline(WHISPER_MODEL)
+
+# Jumlah potongan VAD yang diproses pipeline sekaligus per klip
+PIPELINE_BATCH_SIZE = 8
+
+def _decode_audio_bytes(file_bytes: bytes) -> np.ndarray:
+    """
+    Decode byte audio langsung dari memori menjadi array float32 mono 16 kHz.
+    Args:
+        file_bytes (bytes): Isi file audio
+    Returns:
+        np.ndarray: Sampel audio siap ditranskrip
+    """
+    audio, sample_rate = sf.read(io.BytesIO(file_bytes), dtype="float32")
+
+    # konversi stereo ke mono bila perlu
+    if audio.ndim > 1:
+        audio = audio.mean(axis=1)
 
-# path ke binary whisper.cpp dan model
-WHISPER_BINARY = os.path.join(WHISPER_DIR, "build", "bin", "whisper-cli")
+    # resample ke 16 kHz bila perlu
+    if sample_rate != WHISPER_SAMPLE_RATE:
+        audio = librosa.resample(
+            audio, orig_sr=sample_rate, target_sr=WHISPER_SAMPLE_RATE
+        )
 
-# path ke model whisper
-WHISPER_MODEL_PATH = os.path.join(WHISPER_DIR, "models", "ggml-small-q5_1.bin")
+    return audio
 
 def transcribe_speech_to_text(file_bytes: bytes, file_ext: str = ".wav") -> str:
     """
-    Transkrip file audio menggunakan whisper.cpp CLI
+    Transkrip file audio menggunakan model whisper in-process
     Args:
         file_bytes (bytes): Isi file audio
         file_ext (str): Ekstensi file, default ".wav"
     Returns:
         str: Teks hasil transkripsi
     """
-    with tempfile.TemporaryDirectory() as tmpdir:
-        audio_path = os.path.join(tmpdir, f"{uuid.uuid4()}{file_ext}")
-        output_basename = os.path.join(tmpdir, "transcription")
-        result_path = output_basename + ".txt"
-
-        # simpan audio ke file temporer
-        with open(audio_path, "wb") as f:
-            f.write(file_bytes)
-
-        # jalankan whisper.cpp dengan subprocess
-        cmd = [
-            WHISPER_BINARY,
-            "-m", WHISPER_MODEL_PATH,
-            "-f", audio_path,
-            "-otxt",
-            "-of", output_basename
-        ]
+    try:
+        audio = _decode_audio_bytes(file_bytes)
+    except Exception as e:
+        return f"[ERROR] Failed to decode audio: {e}"
 
-        try:
-            subprocess.run(cmd, check=True)
-        except subprocess.CalledProcessError as e:
-            return f"[ERROR] Whisper failed: {e}"
+    try:
+        segments, _ = WHISPER_MODEL.transcribe(
+            audio,
+            language="id",
+            beam_size=1,
+            vad_filter=True
+        )
+        return "".join(segment.text for segment in segments)
+    except Exception as e:
+        return f"[ERROR] Whisper failed: {e}"
+
+def _transcribe_with_pipeline(audio: np.ndarray) -> str:
+    """Transkrip satu array audio lewat pipeline batched"""
+    segments, _ = WHISPER_PIPELINE.transcribe(
+        audio,
+        language="id",
+        beam_size=1,
+        vad_filter=True,
+        batch_size=PIPELINE_BATCH_SIZE
+    )
+    return "".join(segment.text for segment in segments)
+
+class SttBatcher:
+    """
+    Antrian kerja untuk STT.
+
+    Pipeline whisper bukan objek thread-safe, jadi request konkuren
+    masuk ke asyncio.Queue dan satu worker memprosesnya berurutan tanpa
+    menunda: apa pun yang sudah mengantre diambil dan langsung
+    ditranskrip. Batching sesungguhnya terjadi di dalam
+    WHISPER_PIPELINE, antar potongan VAD dari klip yang sama.
+    """
+
+    def __init__(self):
+        self._queue = None
+        self._worker = None
+
+    async def submit(self, file_bytes: bytes, file_ext: str = ".wav") -> str:
+        """
+        Kirim audio ke scheduler dan tunggu hasil transkripsinya.
+        Args:
+            file_bytes (bytes): Isi file audio
+            file_ext (str): Ekstensi file, default ".wav"
+        Returns:
+            str: Teks hasil transkripsi
+        """
+        loop = asyncio.get_running_loop()
+        self._ensure_worker(loop)
 
-        # baca hasil transkripsi
         try:
-            with open(result_path, "r", encoding="utf-8") as result_file:
-                return result_file.read()
-        except FileNotFoundError:
-            return "[ERROR] Transcription file not found"
+            audio = await loop.run_in_executor(None, _decode_audio_bytes, file_bytes)
+        except Exception as e:
+            return f"[ERROR] Failed to decode audio: {e}"
+
+        future = loop.create_future()
+        await self._queue.put((audio, future))
+        return await future
+
+    def _ensure_worker(self, loop):
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def _collect(self):
+        """Tunggu satu request lalu ambil semua yang sudah mengantre, tanpa menunda"""
+        batch = [await self._queue.get()]
+        while True:
+            try:
+                batch.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            for audio, future in batch:
+                try:
+                    text = await loop.run_in_executor(
+                        None, _transcribe_with_pipeline, audio
+                    )
+                except Exception as e:
+                    text = f"[ERROR] Whisper failed: {e}"
+                if not future.done():
+                    future.set_result(text)
+
+# Scheduler tunggal yang dipakai endpoint FastAPI
+stt_batcher = SttBatcher()
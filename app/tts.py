@@ -1,7 +1,9 @@
 import os
-import uuid
-import tempfile
-import subprocess
+import hashlib
+import threading
+
+import torch
+from TTS.utils.synthesizer import Synthesizer
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -18,7 +20,81 @@ COQUI_CONFIG_PATH = os.path.join(COQUI_DIR, "config.json")
 COQUI_SPEAKERS_PATH = os.path.join(COQUI_DIR, "speakers.pth")
 
 # Tentukan nama speaker yang digunakan
-COQUI_SPEAKER = "wibowo" 
+COQUI_SPEAKER = "wibowo"
+
+# Cache hasil sintesis, di-address berdasarkan isi teks + speaker:
+# teks yang berulang (sapaan, kalimat error) tidak disintesis ulang
+CACHE_DIR = os.path.join(BASE_DIR, "tts_cache")
+CACHE_MAX_FILES = 256
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+def _cache_path(text: str) -> str:
+    key = hashlib.sha1(f"{text}|{COQUI_SPEAKER}".encode("utf-8")).hexdigest()
+    return os.path.join(CACHE_DIR, f"{key}.wav")
+
+def _evict_cache():
+    """Buang file cache tertua (mtime) saat jumlahnya melewati batas"""
+    try:
+        entries = [os.path.join(CACHE_DIR, name) for name in os.listdir(CACHE_DIR)]
+        if len(entries) <= CACHE_MAX_FILES:
+            return
+        entries.sort(key=os.path.getmtime)
+        for path in entries[:len(entries) - CACHE_MAX_FILES]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    except OSError as e:
+        print(f"[WARNING] TTS cache eviction failed: {e}")
+
+# Synthesizer dimuat sekali (lazy) dan dipakai ulang semua request,
+# menggantikan subprocess CLI yang reload bobot model tiap panggilan
+_synthesizer = None
+_synthesizer_lock = threading.Lock()
+
+_USE_CUDA = torch.cuda.is_available()
+
+def _quantize_model(synthesizer: Synthesizer):
+    """Kuantisasi model TTS: FP16 di GPU, INT8 dinamis (Linear) di CPU"""
+    try:
+        if _USE_CUDA:
+            synthesizer.tts_model = synthesizer.tts_model.half().cuda()
+        else:
+            synthesizer.tts_model = torch.quantization.quantize_dynamic(
+                synthesizer.tts_model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+    except Exception as e:
+        # kualitas lebih penting dari kecepatan: gagal kuantisasi -> tetap FP32
+        print(f"[WARNING] TTS quantization failed, keeping FP32: {e}")
+
+def _get_synthesizer() -> Synthesizer:
+    """Muat Synthesizer Coqui sekali dan kembalikan instance yang sama"""
+    global _synthesizer
+    with _synthesizer_lock:
+        if _synthesizer is None:
+            _synthesizer = Synthesizer(
+                tts_checkpoint=COQUI_MODEL_PATH,
+                tts_config_path=COQUI_CONFIG_PATH,
+                tts_speakers_file=COQUI_SPEAKERS_PATH,
+                use_cuda=_USE_CUDA,
+            )
+            _quantize_model(_synthesizer)
+        return _synthesizer
+
+def _fallback_audio(reason: str) -> str:
+    """Pakai salinan audio contoh sebagai fallback saat sintesis gagal"""
+    # Isi fallback selalu sama, jadi cukup satu file tetap di cache;
+    # tereviksi pun akan disalin ulang saat dibutuhkan lagi
+    fallback_path = os.path.join(CACHE_DIR, "fallback.wav")
+    if os.path.exists(fallback_path):
+        os.utime(fallback_path, None)
+        return fallback_path
+    sample_audio = os.path.join(COQUI_DIR, "test_output.wav")
+    if os.path.exists(sample_audio):
+        with open(sample_audio, "rb") as src, open(fallback_path, "wb") as dst:
+            dst.write(src.read())
+        return fallback_path
+    return f"[ERROR] {reason} and no fallback available"
 
 def transcribe_text_to_speech(text: str) -> str:
     """
@@ -33,8 +109,12 @@ def transcribe_text_to_speech(text: str) -> str:
 
 # === ENGINE 1: Coqui TTS ===
 def _tts_with_coqui(text: str) -> str:
-    tmp_dir = tempfile.gettempdir()
-    output_path = os.path.join(tmp_dir, f"tts_{uuid.uuid4()}.wav")
+    output_path = _cache_path(text)
+
+    # cache hit: sentuh mtime agar tidak cepat tereviksi, lalu pakai ulang
+    if os.path.exists(output_path):
+        os.utime(output_path, None)
+        return output_path
 
     # Verify all required files exist before running
     for path, desc in [
@@ -44,54 +124,25 @@ def _tts_with_coqui(text: str) -> str:
     ]:
         if not os.path.exists(path):
             print(f"[ERROR] {desc} not found at {path}")
-            # Fallback to create an empty audio file
-            fallback_path = os.path.join(tmp_dir, f"fallback_tts_{uuid.uuid4()}.wav")
-            sample_audio = os.path.join(COQUI_DIR, "test_output.wav")
-            if os.path.exists(sample_audio):
-                with open(sample_audio, "rb") as src, open(fallback_path, "wb") as dst:
-                    dst.write(src.read())
-                return fallback_path
-            return f"[ERROR] {desc} not found and no fallback available"
-
-    # jalankan Coqui TTS dengan subprocess
-    cmd = [
-        "tts",
-        "--text", text,
-        "--model_path", COQUI_MODEL_PATH,
-        "--config_path", COQUI_CONFIG_PATH,
-        "--speakers_file_path", COQUI_SPEAKERS_PATH,
-        "--speaker_idx", COQUI_SPEAKER,
-        "--out_path", output_path
-    ]
-    
+            return _fallback_audio(f"{desc} not found")
+
     try:
-        # Print command for debugging
-        print(f"Running TTS command: {' '.join(cmd)}")
-        
-        subprocess.run(cmd, check=True)
-        
+        synthesizer = _get_synthesizer()
+        # model belum tentu thread-safe, jadi satu inferensi pada satu waktu
+        with _synthesizer_lock, torch.inference_mode():
+            if _USE_CUDA:
+                with torch.autocast("cuda", dtype=torch.float16):
+                    wav = synthesizer.tts(text, speaker_name=COQUI_SPEAKER)
+            else:
+                wav = synthesizer.tts(text, speaker_name=COQUI_SPEAKER)
+        synthesizer.save_wav(wav, output_path)
+
         # Verify the file exists before returning
         if os.path.exists(output_path):
+            _evict_cache()
             return output_path
-        else:
-            print(f"[ERROR] TTS output file not created at {output_path}")
-            # Fallback to create an empty audio file
-            fallback_path = os.path.join(tmp_dir, f"fallback_tts_{uuid.uuid4()}.wav")
-            # Copy an existing audio file as fallback
-            sample_audio = os.path.join(COQUI_DIR, "test_output.wav")
-            if os.path.exists(sample_audio):
-                with open(sample_audio, "rb") as src, open(fallback_path, "wb") as dst:
-                    dst.write(src.read())
-                return fallback_path
-            return "[ERROR] Failed to create audio file"
-    except subprocess.CalledProcessError as e:
-        print(f"[ERROR] TTS subprocess failed: {e}")
-        # Try to provide a fallback audio file
-        fallback_path = os.path.join(tmp_dir, f"fallback_tts_{uuid.uuid4()}.wav")
-        # Copy an existing audio file as fallback
-        sample_audio = os.path.join(COQUI_DIR, "test_output.wav")
-        if os.path.exists(sample_audio):
-            with open(sample_audio, "rb") as src, open(fallback_path, "wb") as dst:
-                dst.write(src.read())
-            return fallback_path
-        return "[ERROR] Failed to synthesize speech"
\ No newline at end of file
+        print(f"[ERROR] TTS output file not created at {output_path}")
+        return _fallback_audio("Failed to create audio file")
+    except Exception as e:
+        print(f"[ERROR] TTS synthesis failed: {e}")
+        return _fallback_audio("Failed to synthesize speech")
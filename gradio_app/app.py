@@ -1,16 +1,17 @@
 # file app.py
 
+import io
 import os
 import tempfile
-import json
 import time
+import httpx
+import orjson
 import requests
 import gradio as gr
 import scipy.io.wavfile
 import logging
 from typing import Dict, Tuple, Optional, Any, List
 import configparser
-import ast
 
 # Setup logging
 logging.basicConfig(
@@ -41,27 +42,48 @@ MAX_LOGS = int(config['DEFAULT']['max_logs'])
 conversation_history = []
 process_logs = []
 
+# Shared async HTTP client: reuses pooled keep-alive connections and
+# multiplexes over HTTP/2 instead of a fresh TCP/TLS handshake per call
+CLIENT = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(120.0, connect=5.0),
+    limits=httpx.Limits(max_keepalive_connections=10)
+)
+
 def save_config():
     """Save current configuration to file"""
     with open(CONFIG_FILE, 'w') as configfile:
         config.write(configfile)
 
+# TTL memo for /status: page reloads and repeated checks within the
+# window reuse the last result instead of a fresh 5 s-timeout GET
+STATUS_CACHE_TTL = 10  # seconds
+_status_cache = {"t": 0.0, "v": None, "url": None}
+
 def check_api_status() -> Dict[str, Any]:
     """Check if the API server is running and get component status"""
+    if (_status_cache["v"] is not None
+            and _status_cache["url"] == API_URL
+            and time.time() - _status_cache["t"] < STATUS_CACHE_TTL):
+        return _status_cache["v"]
+
     try:
         response = requests.get(f"{API_URL}/status", timeout=5)
         if response.status_code == 200:
-            return response.json()
+            result = response.json()
         else:
-            return {"api": "error", "message": f"API returned status code {response.status_code}"}
+            result = {"api": "error", "message": f"API returned status code {response.status_code}"}
     except requests.exceptions.RequestException as e:
-        return {"api": "error", "message": f"Could not connect to API: {str(e)}"}
+        result = {"api": "error", "message": f"Could not connect to API: {str(e)}"}
+
+    _status_cache.update(t=time.time(), v=result, url=API_URL)
+    return result
 
 def format_process_info(process_info: str) -> str:
     """Format process info from API response header for display"""
     try:
-        # Convert string representation of dict to actual dict
-        data = ast.literal_eval(process_info)
+        # Parse the JSON header into a dict
+        data = orjson.loads(process_info)
         
         # Format as markdown for display
         md = "### Processing Information\n\n"
@@ -77,10 +99,10 @@ def format_process_info(process_info: str) -> str:
         
         return md
     except Exception as e:
-        logger.error(f"Error formatting process info: {e}")
+        logger.error("Error formatting process info: %s", e)
         return f"Error parsing processing info: {str(e)}"
 
-def voice_chat(audio, api_url_input) -> Tuple[Optional[str], str, str]:
+async def voice_chat(audio, api_url_input) -> Tuple[Optional[str], str, str]:
     """
     Send voice to API and get response
     
@@ -101,7 +123,7 @@ def voice_chat(audio, api_url_input) -> Tuple[Optional[str], str, str]:
         API_URL = api_url_input
         config['DEFAULT']['api_url'] = API_URL
         save_config()
-        logger.info(f"Updated API URL to {API_URL}")
+        logger.info("Updated API URL to %s", API_URL)
     
     if audio is None:
         return None, "❌ No audio recorded", "Please record audio first"
@@ -112,20 +134,17 @@ def voice_chat(audio, api_url_input) -> Tuple[Optional[str], str, str]:
     log_entry = f"--- {time.strftime('%Y-%m-%d %H:%M:%S')} ---\n"
     
     try:
-        # Save as .wav
-        log_entry += "Saving temporary audio file...\n"
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmpfile:
-            scipy.io.wavfile.write(tmpfile.name, sr, audio_data)
-            audio_path = tmpfile.name
-            log_entry += f"Audio saved to {audio_path}\n"
-        
+        # Encode as .wav in memory; no temp file on the client side
+        log_entry += "Encoding audio in memory...\n"
+        wav_buffer = io.BytesIO()
+        scipy.io.wavfile.write(wav_buffer, sr, audio_data)
+
         # Send to FastAPI endpoint
         log_entry += f"Sending request to API at {API_URL}/voice-chat...\n"
         start_time = time.time()
-        
-        with open(audio_path, "rb") as f:
-            files = {"audio": ("voice.wav", f, "audio/wav")}
-            response = requests.post(f"{API_URL}/voice-chat", files=files)
+
+        files = {"audio": ("voice.wav", wav_buffer.getvalue(), "audio/wav")}
+        response = await CLIENT.post(f"{API_URL}/voice-chat", files=files)
         
         request_time = time.time() - start_time
         log_entry += f"Request completed in {request_time:.2f} seconds\n"
@@ -143,10 +162,7 @@ def voice_chat(audio, api_url_input) -> Tuple[Optional[str], str, str]:
             
             log_entry += f"Response saved to {output_audio_path}\n"
             log_entry += "Processing completed successfully ✅\n"
-            
-            # Clean up input file
-            os.unlink(audio_path)
-            
+
             # Add to process logs
             process_logs.append(log_entry)
             if len(process_logs) > MAX_LOGS:
@@ -163,7 +179,7 @@ def voice_chat(audio, api_url_input) -> Tuple[Optional[str], str, str]:
         error_msg = f"❌ Error: {str(e)}"
         log_entry += f"{error_msg}\n"
         process_logs.append(log_entry)
-        logger.error(f"Error in voice_chat: {e}", exc_info=True)
+        logger.error("Error in voice_chat: %s", e, exc_info=True)
         return None, error_msg, log_entry
 
 def check_connection(api_url_input) -> str: